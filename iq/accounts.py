@@ -1,8 +1,10 @@
 import datetime
+import hmac
 import logging
 import re
 
 from google.appengine.api import mail
+from google.appengine.api import memcache
 from google.appengine.ext import db
 
 import hash
@@ -62,6 +64,33 @@ class InvalidAccountStateException(AccountException): pass
 class InvalidActivationException(AccountException): pass
 
 
+# Stand-in credential compared against when no account matches a login
+# attempt, so unknown names cost the same hash-and-compare as known ones
+# and can't be enumerated by timing.
+_DUMMY_HASH = hash.IHash('')
+
+
+# hmac.compare_digest only arrived in 2.7.7; the deployed runtime is older.
+_compare_digest = getattr(hmac, 'compare_digest', None)
+
+
+def constantTimeCompare(a, b):
+  # Comparison time depends only on the length of the inputs, not on how
+  # many leading characters happen to match.
+  if isinstance(a, unicode):
+    a = a.encode('utf-8')
+  if isinstance(b, unicode):
+    b = b.encode('utf-8')
+  if _compare_digest is not None:
+    return _compare_digest(a, b)
+  if len(a) != len(b):
+    return False
+  result = 0
+  for x, y in zip(a, b):
+    result |= ord(x) ^ ord(y)
+  return result == 0
+
+
 VERB_SIGNED_UP = system.Verb('signed up')
 
 @system.capture(VERB_SIGNED_UP)
@@ -69,6 +98,12 @@ def onAccountActivated(action):
   system.incrementAccountCount()
 
 
+# Key of the anonymous account, memoized after the first lookup so that new
+# sessions don't re-run the id query.  Only the key is cached; the entity is
+# re-fetched to avoid handing out a stale copy.
+_anonymous_key = None
+
+
 class Account(db.Expando):
   # Unique identifier for this account
   #   Examples:
@@ -112,13 +147,20 @@ class Account(db.Expando):
   NAME_LETTER_PATTERN = re.compile(r'[A-Za-z]')
 
   MAX_EMAIL_LENGTH = 32
-  EMAIL_PATTERN = re.compile(r'.+@.+\...+')
+
+  # How long getById/getByEmail results may be served from memcache.
+  CACHE_TIME = 3600
 
   def put(self):
-    self.id = self.id.lower()
-    if self.email:
+    if not self.id.islower():
+      self.id = self.id.lower()
+    if self.email and not self.email.islower():
       self.email = self.email.lower()
-    return db.Model.put(self)
+    result = db.Model.put(self)
+    memcache.delete('account:%s' % self.id)
+    if self.email:
+      memcache.delete('account-email:%s' % self.email)
+    return result
 
   @classmethod
   def validateName(cls, name):
@@ -135,7 +177,13 @@ class Account(db.Expando):
   @classmethod
   def validateEmail(cls, email):
     email = email.strip()
-    if cls.EMAIL_PATTERN.match(email) is None:
+    # Plain scans instead of a backtracking regex: one '@' with something
+    # before it, then a '.' with at least two characters after it.
+    at = email.find('@')
+    if at <= 0 or email.find('@', at + 1) != -1:
+      raise InvalidEmail(InvalidEmail.INVALID_FORMAT)
+    dot = email.find('.', at + 2)
+    if dot == -1 or dot + 2 >= len(email):
       raise InvalidEmail(InvalidEmail.INVALID_FORMAT)
     if len(email) > cls.MAX_EMAIL_LENGTH:
       raise InvalidEmail(InvalidEmail.TOO_LONG % cls.MAX_EMAIL_LENGTH)
@@ -144,8 +192,14 @@ class Account(db.Expando):
 
   @classmethod
   def getById(cls, id):
-    query = cls.all().filter('id =', id.lower())
-    return query.get()
+    id = id.lower()
+    cache_key = 'account:%s' % id
+    account = memcache.get(cache_key)
+    if account is None:
+      account = cls.all().filter('id =', id).get()
+      if account:
+        memcache.set(cache_key, account, time=cls.CACHE_TIME)
+    return account
 
   @classmethod
   def getByShortId(cls, id):
@@ -158,8 +212,14 @@ class Account(db.Expando):
   @classmethod
   def getByEmail(cls, email):
     email = email.strip().lower()
-    logging.info("Looking up account by email: %r", email)
-    return cls.all().filter('email =', email).get()
+    logging.debug("Looking up account by email: %r", email)
+    cache_key = 'account-email:%s' % email
+    account = memcache.get(cache_key)
+    if account is None:
+      account = cls.all().filter('email =', email).get()
+      if account:
+        memcache.set(cache_key, account, time=cls.CACHE_TIME)
+    return account
 
   @classmethod
   def getByGoogleAccount(cls, user):
@@ -170,10 +230,16 @@ class Account(db.Expando):
 
   @classmethod
   def getAnonymous(cls):
+    global _anonymous_key
+    if _anonymous_key:
+      account = cls.get(_anonymous_key)
+      if account:
+        return account
     account = cls.getById('iq/anonymous')
     if account is None:
       account = cls(id='iq/anonymous', name='Anonymous')
       account.put()
+    _anonymous_key = account.key()
     return account
 
   @classmethod
@@ -201,12 +267,18 @@ class Account(db.Expando):
     else:
       logging.info('getting by id: %r', id)
       account = cls.getById(id)
+    if account and account.trusted:
+      stored = account.password or ''
+    else:
+      stored = _DUMMY_HASH
+    hashpw = hash.IHash(password)
+    ok = (constantTimeCompare(stored, hashpw)
+          or constantTimeCompare(stored, password))
     if not account or not account.trusted:
       raise NoSuchAccountException
     if account.activated is None and account.password is None:
       raise NotActivatedException
-    hashpw = hash.IHash(password)
-    if account.password != password and account.password != hashpw:
+    if not ok:
       raise InvalidPasswordException
     return account
 
@@ -270,10 +342,13 @@ class Account(db.Expando):
     account.put()
     return account
 
-  def setupActivation(self, mailer, base_url):
+  def setupActivation(self, mailer, base_url, defer_put=False):
+    # Callers that will put() the account themselves can pass defer_put to
+    # save the intermediate write.
     if not self.activation:
       self.activation = hash.IHash(None)
-      self.put()
+      if not defer_put:
+        self.put()
       logging.info("Activating account: id=%r, email=%r, activation=%r",
                    self.id, self.email, self.activation)
       self.sendConfirmationEmail(mailer, base_url)
@@ -313,6 +388,13 @@ class Account(db.Expando):
     if not self.trusted:
       return False
     sys = system.getSystem()
+    if sys.owner:
+      return False
+    # The cached System can be arbitrarily old, and claiming ownership on
+    # its say-so would let a later trusted user steal the site from an
+    # instance that never saw the real owner.  Re-read fresh before
+    # claiming.
+    sys = system.getSystem(fresh=True)
     if sys.owner:
       return False
     logging.info('Making %s owner and admin', self.name)
@@ -335,6 +417,7 @@ class Account(db.Expando):
 
 class Session(db.Expando):
   LIFETIME_DAYS = 14
+  DELETE_BATCH_SIZE = 500
 
   id = db.StringProperty(required=True)
   account = db.ReferenceProperty(Account)
@@ -345,17 +428,24 @@ class Session(db.Expando):
   def expireAll(cls):
     now = provider.IClock(None).now()
     expiration = now - datetime.timedelta(days=cls.LIFETIME_DAYS)
-    query = cls.all().filter("created <", expiration)
-    for session in query:
-      session.delete()
-    logging.info("Deleted sessions: %d", query.count())
+    query = cls.all(keys_only=True).filter("created <", expiration)
+    deleted = 0
+    while True:
+      keys = query.fetch(limit=cls.DELETE_BATCH_SIZE)
+      if not keys:
+        break
+      db.delete(keys)
+      deleted += len(keys)
+      if len(keys) < cls.DELETE_BATCH_SIZE:
+        break
+    logging.info("Deleted sessions: %d", deleted)
 
   @classmethod
   def load(cls, session_id):
-    logging.info("Loading session: %s", session_id)
+    logging.debug("Loading session: %s", session_id)
     session = cls.get_by_key_name(session_id)
     if session is None:
-      logging.info("Creating new session: %s", session_id)
+      logging.debug("Creating new session: %s", session_id)
       session = cls(key_name=session_id,
                     id=session_id,
                     account=Account.getAnonymous(),
@@ -25,6 +25,7 @@ class PageSpecifier:
                reversed=False,
                account=None,
                context=None,
+               cursor=None,
               ):
     self.mode = mode
     self.start_value = start_value
@@ -33,6 +34,7 @@ class PageSpecifier:
     self.reversed = reversed
     self.account = account
     self.context = context
+    self.cursor = cursor
 
   def copy(self, **overrides):
     kwargs = overrides.copy()
@@ -46,27 +48,31 @@ class PageSpecifier:
     copyAttribute('reversed')
     copyAttribute('account')
     copyAttribute('context')
-    logging.info('page copy: %r', kwargs)
+    copyAttribute('cursor')
+    logging.debug('page copy: %r', kwargs)
     return PageSpecifier(**kwargs)
 
+  # Maps encoded parameter keys to the constructor kwarg and its parser.
+  _DECODERS = {
+    'm': ('mode', lambda value: value),
+    'd': ('start_value', lambda value: PageSpecifier.decodeDateTime(value)),
+    'o': ('offset', int),
+    's': ('size', int),
+    'r': ('reversed', lambda value: bool(int(value))),
+    'a': ('account', lambda value: accounts.Account.getById(value)),
+    'c': ('cursor', lambda value: value),
+  }
+
   @staticmethod
   def decode(encoded):
-    logging.info('decoding page spec: %r', encoded)
+    logging.debug('decoding page spec: %r', encoded)
     kwargs = {}
-    params = encoded.split(';')
-    for param in params:
-      if param.startswith('m='):
-        kwargs['mode'] = param[2:]
-      elif param.startswith('d='):
-        kwargs['start_value'] = PageSpecifier.decodeDateTime(param[2:])
-      elif param.startswith('o='):
-        kwargs['offset'] = int(param[2:])
-      elif param.startswith('s='):
-        kwargs['size'] = int(param[2:])
-      elif param.startswith('r='):
-        kwargs['reversed'] = bool(int(param[2:]))
-      elif param.startswith('a='):
-        kwargs['account'] = accounts.Account.getById(param[2:])
+    for param in encoded.split(';'):
+      key, _, value = param.partition('=')
+      entry = PageSpecifier._DECODERS.get(key)
+      if entry:
+        name, parser = entry
+        kwargs[name] = parser(value)
     return PageSpecifier(**kwargs)
 
   def encode(self):
@@ -81,28 +87,31 @@ class PageSpecifier:
       params.append(('r', '1'))
     if self.account:
       params.append(('a', self.account.id))
+    if self.cursor:
+      params.append(('c', self.cursor))
     return ';'.join('%s=%s' % param for param in params)
     
   @staticmethod
   def encodeDateTime(value):
-    # 2008/04/19 14:02:56.123456 -> 7d8 4 13 0e 02 56 1e240 -> 7d84130e02561e240
-    return '%03x%x%02x%02x%02x%02x%05x' % (
-        value.year, value.month, value.day, value.hour, value.minute,
-        value.second, value.microsecond)
+    # Pack all fields into a single integer (12/4/5/5/6/6/20 bits for
+    # year/month/day/hour/minute/second/microsecond) and hex-encode it once.
+    n = (value.year << 46 | value.month << 42 | value.day << 37
+         | value.hour << 32 | value.minute << 26 | value.second << 20
+         | value.microsecond)
+    return '%017x' % n
 
   @staticmethod
   def decodeDateTime(value):
     if len(value) != 17:
       raise ValueError(value)
-    year = int(value[:3], 16)
-    month = int(value[3], 16)
-    day = int(value[4:6], 16)
-    hour = int(value[6:8], 16)
-    minute = int(value[8:10], 16)
-    second = int(value[10:12], 16)
-    microsecond = int(value[12:], 16)
-    return datetime.datetime(year, month, day, hour, minute, second,
-                             microsecond)
+    n = int(value, 16)
+    return datetime.datetime(n >> 46,
+                             (n >> 42) & 0xf,
+                             (n >> 37) & 0x1f,
+                             (n >> 32) & 0x1f,
+                             (n >> 26) & 0x3f,
+                             (n >> 20) & 0x3f,
+                             n & 0xfffff)
 
   def __str__(self):
     return '<PageSpecifier mode=%s start=%s offset=%s reversed=%s>' % (
@@ -130,6 +139,7 @@ class BrowseService(service.Service):
     if page_spec.reversed:
       prev_page_spec, next_page_spec = next_page_spec, prev_page_spec
       quote_list.reverse()
+    quotes.Quote.prefetchParents(quote_list)
     self.template.quotes = quote_list
 
     def maybeExportPage(name, spec, require_full_page):
@@ -141,11 +151,12 @@ class BrowseService(service.Service):
         return
       if spec.reversed and not spec.start_value:
         return
-      logging.info('latest quote: %s', system.getSystem().latest_quote)
+      latest_quote = system.getSystem().latest_quote
+      logging.info('latest quote: %s', latest_quote)
       if (spec.reversed
           and spec.start_value
-          and system.getSystem().latest_quote
-          and spec.start_value >= system.getSystem().latest_quote):
+          and latest_quote
+          and spec.start_value >= latest_quote):
         return
       logging.info('template should include link to page spec: %s', spec)
       setattr(self.template, name, spec)
@@ -159,23 +170,26 @@ class BrowseService(service.Service):
                                           limit=page.size,
                                           reversed=page.reversed,
                                           ancestor=page.account,
+                                          cursor=page.cursor,
                                          )
-    quote_list, start, offset = result
+    quote_list, start, cursor = result
     if page.reversed:
       prev_offset = 1
     else:
       prev_offset = 0
-    next = page.copy(start_value=start, offset=offset)
-    prev = page.copy(reversed=not page.reversed, offset=prev_offset)
+    next = page.copy(start_value=start, offset=0, cursor=cursor)
+    prev = page.copy(reversed=not page.reversed, offset=prev_offset,
+                     cursor=None)
     return quote_list, next, prev
 
   def fetch_draft(self, page):
-    quote_list = quotes.Quote.getDraftQuotes(account=self.account,
-                                             offset=page.offset,
-                                             limit=page.size,
-                                            )
-    next = page.copy(offset=page.offset + page.size)
-    prev = page.copy(offset=page.offset - page.size)
+    quote_list, cursor = quotes.Quote.getDraftQuotes(account=self.account,
+                                                     offset=page.offset,
+                                                     limit=page.size,
+                                                     cursor=page.cursor,
+                                                    )
+    next = page.copy(offset=page.offset + page.size, cursor=cursor)
+    prev = page.copy(offset=page.offset - page.size, cursor=None)
     return quote_list, next, prev
 
   def fetch_label(self, page):
@@ -187,19 +201,22 @@ class BrowseService(service.Service):
                                           ancestor=page.account,
                                           where=['labels = :label'],
                                           params={'label': label},
+                                          cursor=page.cursor,
                                          )
-    quote_list, start, offset = result
+    quote_list, start, cursor = result
     if page.reversed:
       prev_offset = 1
     else:
       prev_offset = 0
     context = 'l=%s' % urllib.quote(label)
     next = page.copy(start_value=start,
-                     offset=offset,
+                     offset=0,
+                     cursor=cursor,
                      context=context,
                     )
     prev = page.copy(reversed=not page.reversed,
                      offset=prev_offset,
+                     cursor=None,
                      context=context,
                     )
     return quote_list, next, prev
@@ -2,16 +2,37 @@ import datetime
 import logging
 import pickle
 import re
+import string
 import time
 import urllib
 
+import simplejson
+
+from google.appengine.api import memcache
 from google.appengine.ext import db
 from google.appengine.ext import search
 
+try:
+  from google.appengine.api.labs import taskqueue
+except ImportError:
+  taskqueue = None
+
 import accounts
 import provider
 import system
 
+# Memoized re.compile for dynamically-constructed patterns.  Fixed patterns
+# stay compiled at class scope; anything built from strings at runtime
+# should go through compilePattern so it is only compiled once.
+_pattern_cache = {}
+
+def compilePattern(pattern, flags=0):
+  compiled = _pattern_cache.get((pattern, flags))
+  if compiled is None:
+    compiled = _pattern_cache[(pattern, flags)] = re.compile(pattern, flags)
+  return compiled
+
+
 class QuoteException(Exception):
   pass
 
@@ -24,14 +45,31 @@ VERB_PUBLISHED = system.Verb('published')
 VERB_DELETED = system.Verb('deleted')
 VERB_UPDATED = system.Verb('updated')
 
+def deferIncrementQuoteCount(amount, timestamp=None):
+  # Push the counter transaction onto the task queue so the publishing
+  # request doesn't wait on it; fall back to the inline update when no
+  # queue is available (old SDKs, the test harness).
+  if taskqueue is not None:
+    params = {'amount': str(amount)}
+    if timestamp:
+      params['timestamp'] = repr(time.mktime(timestamp.timetuple())
+                                 + timestamp.microsecond / 1e6)
+    try:
+      taskqueue.add(url='/tasks/increment-quote-count', params=params)
+      return
+    except Exception:
+      logging.exception('enqueue failed, updating quote count inline')
+  system.incrementQuoteCount(amount, timestamp=timestamp)
+
+
 @system.capture(VERB_PUBLISHED)
 def onQuotePublished(action):
-  system.incrementQuoteCount(timestamp=action.timestamp)
+  deferIncrementQuoteCount(1, timestamp=action.timestamp)
 
 
 @system.capture(VERB_DELETED)
 def onQuoteDeleted(action):
-  system.incrementQuoteCount(-1)
+  deferIncrementQuoteCount(-1)
 
 
 class Line:
@@ -57,46 +95,80 @@ class ILineParser(provider.Interface):
 
 
 class LineFormatterRegistry(type):
-  NL = re.compile(r'\r?\n')
-  INDENT = re.compile(r'^(\s*)')
-
   registry = []
-  
+  combined = None
+
   def __new__(cls, *args, **kwargs):
     instance = type.__new__(cls, *args, **kwargs)
     cls.registry.append(instance)
+    # Invalidate the cached alternations whenever a formatter registers.
+    cls.combined = None
     return instance
 
+  @classmethod
+  def combinedPatterns(cls):
+    # Formatters are folded into one named-group alternation so a single
+    # regex call tries all of them at once.  One pattern is kept per
+    # registry suffix so formatters drop out of the scan once they are
+    # done, preserving the ordering of the old per-formatter loop.
+    if cls.combined is None:
+      formatters = [f for f in cls.registry if getattr(f, 'PATTERN', None)]
+      patterns = [
+        compilePattern('|'.join('(?P<%s>%s)' % (f.__name__, f.PATTERN.pattern)
+                                for f in formatters[i:]))
+        for i in xrange(len(formatters))]
+      cls.combined = (formatters, patterns)
+    return cls.combined
+
   @classmethod
   def parseDialog(cls, dialog, preserve_formatting):
     dialog = dialog.strip()
     line_start_indent = 0
     cur_line = []
-    for line in cls.NL.split(dialog):
-      indent = len(cls.INDENT.match(line).group(1))
+    for line in dialog.splitlines():
+      # Leading-whitespace length via lstrip, skipping the regex engine.
+      stripped = line.lstrip()
+      indent = len(line) - len(stripped)
       if indent <= line_start_indent:
         if cur_line:
           yield Line(' '.join(cur_line),
                      preserve_formatting=preserve_formatting)
         del cur_line[:]
         line_start_indent = indent
-      cur_line.append(line.strip())
+      cur_line.append(stripped.rstrip())
     if cur_line:
       yield Line(' '.join(cur_line),
                  preserve_formatting=preserve_formatting)
 
   @classmethod
   def parse(cls, line):
-    for formatter in cls.registry:
-      while True:
-        match = formatter.match(line)
-        if match:
-          yield match
-          line = line[:match.range[0]] + line[match.range[1]:]
-          if not match.multiple:
-            break
-        else:
-          break
+    # Nothing can match an empty line; don't even fire the regex.
+    if not line:
+      return
+    # Scan by index instead of re-slicing the line after each match; ranges
+    # yielded are absolute offsets into the original line.
+    formatters, patterns = cls.combinedPatterns()
+    pos = 0
+    index = 0
+    while index < len(formatters):
+      match = patterns[index].match(line, pos)
+      if not match:
+        break
+      # The leftmost alternative that matched is the first formatter that
+      # would have matched in registry order.
+      position = index
+      while match.group(formatters[position].__name__) is None:
+        position += 1
+      formatter = formatters[position].build(match)
+      if formatter is None:
+        index = position + 1
+        continue
+      yield formatter
+      pos = match.end()
+      if formatter.multiple:
+        index = position
+      else:
+        index = position + 1
 
 
 @provider.adapter(type(None), ILineParser)
@@ -107,6 +179,10 @@ def line_parser(_):
 class LineFormatter(object):
   """Instances of this class describe how to apply formatting to a quote.
 
+  Subclasses define a compiled PATTERN and a build classmethod turning a
+  match of it into an instance (or None to decline the match); the registry
+  folds all patterns into a single alternation.
+
   @type multiple: bool
   @ivar multiple: Whether the formatter could possibly match again.
   @type range: (int, int)
@@ -118,6 +194,8 @@ class LineFormatter(object):
 
   __metaclass__ = LineFormatterRegistry
 
+  PATTERN = None
+
   def __init__(self, range=None, params=None, multiple=False):
     self.range = range
     self.params = params
@@ -128,46 +206,62 @@ class LineFormatter(object):
     return '%s: %r' % (self.__class__.__name__, self.__dict__)
 
   @classmethod
-  def match(cls, line):
+  def match(cls, line, pos=0):
+    if cls.PATTERN is None:
+      return None
+    match = cls.PATTERN.match(line, pos)
+    if match:
+      return cls.build(match)
+
+  @classmethod
+  def build(cls, match):
     return None
 
 
 class TimestampFormatter(LineFormatter):
-  TIME = re.compile(r'^\s*[\[(]?(?P<hour>\d?\d):(?P<minute>\d\d)(:(?P<second>\d\d))?[)\]]?\s*')
+  PATTERN = re.compile(r'\s*[\[(]?(?P<hour>\d?\d):(?P<minute>\d\d)(:(?P<second>\d\d))?[)\]]?\s*')
 
   @classmethod
-  def match(cls, line):
-    match = cls.TIME.match(line)
-    if match:
-      groups = match.groupdict(0)
-      try:
-        timestamp = datetime.time(int(groups['hour']), int(groups['minute']),
-                                  int(groups['second']))
-        return cls(range=(match.start(), match.end()),
-                   params={'timestamp': timestamp},
-                  )
-      except ValueError:
-        return None
+  def build(cls, match):
+    try:
+      timestamp = datetime.time(int(match.group('hour')),
+                                int(match.group('minute')),
+                                int(match.group('second') or 0))
+    except ValueError:
+      return None
+    return cls(range=match.span(),
+               params={'timestamp': timestamp},
+              )
 
 
 class NickFormatter(LineFormatter):
-  NICK = re.compile(r'^\s*[\[<\(]?'
-                    r'(?P<nickflag>[\s@+])?'
-                    r"(?P<nick>[\w\d^`\[\]{}\\|-]+)[\]>\):]+\s?")
+  PATTERN = re.compile(r'\s*[\[<\(]?'
+                       r'(?P<nickflag>[\s@+])?'
+                       r"(?P<nick>[\w\d^`\[\]{}\\|-]+)[\]>\):]+\s?")
   NORMALIZATION = re.compile('[^\w\d]')
+  # The characters NORMALIZATION strips, as a deletion table for the
+  # faster str.translate path.
+  DELETE_CHARS = ''.join(c for c in map(chr, xrange(256))
+                         if c not in string.ascii_letters + string.digits + '_')
+
+  @classmethod
+  def normalizeNick(cls, nick):
+    if isinstance(nick, str):
+      return nick.translate(None, cls.DELETE_CHARS).lower()
+    return cls.NORMALIZATION.sub('', nick).lower()
 
   @classmethod
-  def match(cls, line):
-    match = cls.NICK.match(line)
-    if match and filter(lambda c: not c.isdigit(), match.group('nick')):
-      params = {
-        'normalized_nick':
-          cls.NORMALIZATION.sub('', match.group('nick')).lower(),
-      }
-      params.update(match.groupdict())
-      return cls(range=(match.start(), match.end()),
-                 params=params,
-                )
+  def build(cls, match):
+    nick = match.group('nick')
+    if nick.isdigit():
+      return None
+    return cls(range=match.span(),
+               params={
+                 'nick': nick,
+                 'nickflag': match.group('nickflag'),
+                 'normalized_nick': cls.normalizeNick(nick),
+               },
+              )
 
 
 class Quote(search.SearchableModel):
@@ -181,6 +275,12 @@ class Quote(search.SearchableModel):
   MIN_RATING = -5
   MAX_RATING = 5
 
+  # Cache lifetimes, in seconds.  Published quotes rarely change, so the
+  # by-key cache can live long; the recent page just takes the edge off
+  # the busiest query.
+  CACHE_TIME = 3600
+  RECENT_CACHE_TIME = 60
+
   # The text data
   dialog_source = db.TextProperty(required=True)
   formatting = db.BlobProperty()
@@ -231,7 +331,9 @@ class Quote(search.SearchableModel):
                )
     quote.rebuild()
     def transaction():
-      acc = accounts.Account.get(account.key())
+      # Re-read inside the transaction for a consistent counter update; a
+      # key get is cheaper than re-running the id query.
+      acc = db.get(account.key())
       acc.draft_count += 1
       acc.put()
       return quote
@@ -283,7 +385,13 @@ class Quote(search.SearchableModel):
 
   @classmethod
   def getQuoteByKey(cls, account, key):
-    quote = cls.get(key)
+    cache_key = 'quote:%s' % key
+    quote = memcache.get(cache_key)
+    if quote is None:
+      quote = cls.get(key)
+      # Only published quotes are cached; drafts are private and mutable.
+      if quote and quote.state >= cls.PUBLISHED:
+        memcache.set(cache_key, quote, cls.CACHE_TIME)
     if not quote:
       raise InvalidKeyException
     if quote.state < cls.PUBLISHED and account.key() != quote.parent_key():
@@ -299,16 +407,44 @@ class Quote(search.SearchableModel):
       raise NoPermissionException
     return quote
 
+  @classmethod
+  def prefetchParents(cls, quote_list):
+    # Resolve the parent Accounts for a page of quotes with one batched
+    # get; otherwise each quote.parent() in the templates issues its own.
+    keys = list(set(quote.parent_key() for quote in quote_list
+                    if quote.parent_key() and quote._parent is None))
+    if keys:
+      parents = dict(zip(keys, db.get(keys)))
+      for quote in quote_list:
+        if quote._parent is None:
+          quote._parent = parents.get(quote.parent_key())
+    return quote_list
+
   @classmethod
   def getByLegacyId(cls, legacy_id):
     return cls.all().filter('legacy_id =', legacy_id).get()
 
   @classmethod
   def getRecentQuotes(cls, reversed=False, **kwargs):
-    return cls.getQuotesByTimestamp('submitted',
-                                    descending=not reversed,
-                                    include_drafts=False,
-                                    **kwargs)
+    # The default first page is the hottest read on the site; keep it in
+    # memcache for a short while.  Anything anchored, offset, filtered,
+    # or scoped to an account goes straight to the datastore.
+    cacheable = not (kwargs.get('start') or kwargs.get('cursor')
+                     or kwargs.get('offset') or kwargs.get('ancestor')
+                     or kwargs.get('where'))
+    cache_key = 'recent-quotes:%d:%d' % (bool(reversed),
+                                         kwargs.get('limit', 10))
+    if cacheable:
+      result = memcache.get(cache_key)
+      if result is not None:
+        return result
+    result = cls.getQuotesByTimestamp('submitted',
+                                      descending=not reversed,
+                                      include_drafts=False,
+                                      **kwargs)
+    if cacheable:
+      memcache.set(cache_key, result, cls.RECENT_CACHE_TIME)
+    return result
 
   @classmethod
   def getQuotesByBuildTime(cls, **kwargs):
@@ -324,9 +460,10 @@ class Quote(search.SearchableModel):
                            ancestor=None,
                            where=[],
                            params={},
+                           cursor=None,
                           ):
-    logging.info('quotes by ts: property=%s, start=%s, offset=%s limit=%s, descending=%s, drafts=%s, ancestor=%s',
-                 property, start, offset, limit, descending, include_drafts, ancestor)
+    logging.debug('quotes by ts: property=%s, start=%s, offset=%s limit=%s, descending=%s, drafts=%s, ancestor=%s',
+                  property, start, offset, limit, descending, include_drafts, ancestor)
 
     where = where[:]
     params = params.copy()
@@ -347,30 +484,47 @@ class Quote(search.SearchableModel):
       order = 'ORDER BY %s DESC' % property
     else:
       order = 'ORDER BY %s' % property
-    logging.info('offset=%d, limit=%d', offset, limit)
+    logging.debug('offset=%d, limit=%d', offset, limit)
 
     gql = ("WHERE %s %s" % (' AND '.join(where), order))
-    logging.info('GQL: %s', gql)
+    logging.debug('GQL: %s', gql)
     query = cls.gql(gql, **params)
-    quotes = list(query.fetch(offset=offset, limit=limit))
-    logging.info('got back %d quotes', len(quotes))
-    logging.info('%s', [(i, str(quotes[i].submitted), quotes[i].submitted) for i in xrange(len(quotes))])
+    if cursor:
+      # A cursor picks up exactly where the previous page ended, with no
+      # server-side skip scan.  The query must be identical to the one that
+      # produced the cursor, so the caller passes the same start value back.
+      query.with_cursor(cursor)
+      quotes = list(query.fetch(limit=limit))
+    else:
+      quotes = list(query.fetch(offset=offset, limit=limit))
+    logging.debug('got back %d quotes', len(quotes))
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+      logging.debug('%s', [(i, str(quotes[i].submitted), quotes[i].submitted)
+                           for i in xrange(len(quotes))])
+    next_cursor = None
     if len(quotes) == limit:
-      for i in xrange(2, limit + 1):
-        if quotes[-i].submitted != quotes[-1].submitted:
-          break
-      start = quotes[-1].submitted
-      offset = i - 1
-    return quotes, start, offset
+      next_cursor = query.cursor()
+    return quotes, start, next_cursor
 
   @classmethod
-  def getDraftQuotes(cls, account, offset=0, limit=10, order='-submitted'):
+  def getDraftQuotes(cls, account, offset=0, limit=10, order='-submitted',
+                     cursor=None):
     query = (cls.all()
              .ancestor(account)
              .filter('state =', cls.DRAFT)
              .order(order)
             )
-    return list(query.fetch(offset=offset, limit=limit))
+    # As with getQuotesByTimestamp, a cursor resumes where the previous
+    # page ended instead of paying a server-side skip scan per offset.
+    if cursor:
+      query.with_cursor(cursor)
+      drafts = list(query.fetch(limit=limit))
+    else:
+      drafts = list(query.fetch(offset=offset, limit=limit))
+    next_cursor = None
+    if len(drafts) == limit:
+      next_cursor = query.cursor()
+    return drafts, next_cursor
 
   @classmethod
   def search(cls, query, offset=0, limit=10):
@@ -400,11 +554,41 @@ class Quote(search.SearchableModel):
         self.state = self.DRAFT
       else:
         self.state = self.PUBLISHED
-    return db.Model.put(self)
+    key = db.Model.put(self)
+    memcache.delete('quote:%s' % key)
+    return key
+
+  def delete(self):
+    memcache.delete('quote:%s' % self.key())
+    return db.Model.delete(self)
+
+  def urlKey(self):
+    # str(key) re-serializes the key through protobuf on every call; do
+    # that (and the quoting) once per entity for the redirect builders.
+    if getattr(self, '_url_key', None) is None:
+      self._url_key = urllib.quote(str(self.key()))
+    return self._url_key
+
+  def uncache(self):
+    # Drop this quote and the default recent pages from memcache; called
+    # around writes that bypass put (batched transaction writes, deletes).
+    memcache.delete('quote:%s' % self.key())
+    memcache.delete_multi(['recent-quotes:0:10', 'recent-quotes:1:10'])
+
+  # Names of the properties copied by clone; computed once per class since
+  # the property set is stable.
+  CLONE_PROPERTIES = None
+
+  @classmethod
+  def cloneProperties(cls):
+    if cls.CLONE_PROPERTIES is None:
+      cls.CLONE_PROPERTIES = [prop for prop in cls.properties()
+                              if prop != 'clone_of']
+    return cls.CLONE_PROPERTIES
 
   def getProperties(self):
-    return dict([(prop, getattr(self, prop, None))
-                 for prop in self.properties() if prop != 'clone_of'])
+    return dict((prop, getattr(self, prop, None))
+                for prop in self.cloneProperties())
 
   def clone(self, target=None):
     if target is None:
@@ -414,8 +598,8 @@ class Quote(search.SearchableModel):
         raise InvalidQuoteStateException
       if target.clone_of.key() != self.key():
         raise InvalidQuoteStateException
-      for name, value in self.getProperties().iteritems():
-        setattr(target, name, value)
+      for name in self.cloneProperties():
+        setattr(target, name, getattr(self, name, None))
       return target
 
   def edit(self, account):
@@ -436,6 +620,7 @@ class Quote(search.SearchableModel):
 
   def unpublish(self):
     system.record(self.parent(), VERB_DELETED, self)
+    self.uncache()
     self.delete()
 
   def republish(self, modified=None):
@@ -461,12 +646,15 @@ class Quote(search.SearchableModel):
         self.modified = modified or datetime.datetime.now()
       else:
         self.submitted = modified or datetime.datetime.now()
-      self.put()
-      account = accounts.Account.get(self.parent_key())
+      account = db.get(self.parent_key())
       account.quote_count += 1
       account.draft_count -= 1
-      account.put()
+      # The quote and its account are in the same entity group; write both
+      # with a single RPC.  state is already set above, so the normalization
+      # in Quote.put is not needed here.
+      db.put([self, account])
     db.run_in_transaction(transaction)
+    self.uncache()
     system.record(self.parent(), VERB_PUBLISHED, self, timestamp=self.submitted)
     return self
 
@@ -479,13 +667,28 @@ class Quote(search.SearchableModel):
             ):
     if self.state != self.DRAFT:
       raise InvalidQuoteStateException
-    if dialog is not None:
+    # Re-parsing the dialog is the expensive part of a save; only do it when
+    # the source or formatting mode actually changed (or nothing was ever
+    # built).
+    changed = self.formatting is None
+    if dialog is not None and dialog != self.dialog_source:
       self.dialog_source = dialog
+      changed = True
     if note is not None:
       self.note = note or None
     if preserve_formatting is not None:
-      self.preserve_formatting = preserve_formatting
-    self.rebuild()
+      if preserve_formatting != self.preserve_formatting:
+        self.preserve_formatting = preserve_formatting
+        changed = True
+    # When publishing, the publish transaction writes the quote anyway;
+    # defer the rebuild's put so the edit-and-publish path writes once.
+    # Clones are excepted: publishing one republishes the original and
+    # never writes the draft itself.
+    defer = publish and not self.clone_of
+    if changed:
+      self.rebuild(defer_put=defer)
+    elif not defer:
+      self.put()
     if publish:
       self.publish(modified=modified)
     else:
@@ -495,32 +698,56 @@ class Quote(search.SearchableModel):
     return self.getFormattedDialog()
 
   def getFormattedDialog(self):
-    lines = pickle.loads(self.formatting)
+    try:
+      return simplejson.loads(self.formatting)
+    except (ValueError, TypeError):
+      # Entities written before the JSON format hold pickled Line objects
+      # (or nothing at all).  Rebuild from the dialog source on first
+      # read, which also migrates the stored blob in place.
+      self.rebuild()
+      return simplejson.loads(self.formatting)
+
+  def rebuild(self, defer_put=False):
+    # Quotes are written rarely and viewed often, so resolve the formatting
+    # down to the final {'text': ..., 'params': ...} lines here and store
+    # that as JSON; getFormattedDialog serves it verbatim.  One pass over
+    # the parse generator renders each line and collects nick labels,
+    # without materializing an intermediate line list.
+    rendered = []
+    nicks = set()
+    lines = LineFormatterRegistry.parseDialog(self.dialog_source,
+                                              preserve_formatting=
+                                                self.preserve_formatting)
     for line in lines:
       params = {}
-      text = line.original
+      pieces = []
+      last = 0
       for formatter in line.formatting:
-        text = text[:formatter.range[0]] + text[formatter.range[1]:]
-        params.update(formatter.params)
-      yield {'text': text, 'params': params}
-
-  def rebuild(self):
-    lines = list(LineFormatterRegistry.parseDialog(self.dialog_source,
-                                                   preserve_formatting=
-                                                     self.preserve_formatting))
-    self.formatting = db.Blob(pickle.dumps(lines))
-
-    nicks = set()
-    for line in lines:
-      if line.formatting:
-        for formatter in line.formatting:
-          if 'normalized_nick' in formatter.params:
-            nicks.add(formatter.params['normalized_nick'])
+        pieces.append(line.original[last:formatter.range[0]])
+        last = formatter.range[1]
+        for name, value in formatter.params.iteritems():
+          if isinstance(value, (datetime.time, datetime.datetime)):
+            value = value.isoformat()
+          params[name] = value
+        if 'normalized_nick' in formatter.params:
+          nicks.add(formatter.params['normalized_nick'])
+      pieces.append(line.original[last:])
+      rendered.append({'text': ''.join(pieces), 'params': params})
+    self.formatting = db.Blob(simplejson.dumps(rendered))
+    # Mirror the labels in a set so the membership checks don't rescan the
+    # list once per nick; addLabel stays around for one-off callers.
+    labels = self.labels or []
+    seen = set(labels)
     for nick in nicks:
-      self.addLabel('nick:%s' % nick)
-    logging.info('labels: %r', self.labels)
+      label = 'nick:%s' % nick
+      if label not in seen:
+        seen.add(label)
+        labels.append(label)
+    self.labels = labels
+    logging.debug('labels: %r', self.labels)
     self.built = datetime.datetime.now()
-    self.put()
+    if not defer_put:
+      self.put()
 
   def label(self, prefix):
     return [value for value in self.labels if value.startswith(prefix)]
@@ -533,7 +760,7 @@ class Quote(search.SearchableModel):
       self.labels = []
     label = label.strip().lower()
     if label not in self.labels:
-      logging.info('adding label: %r', label)
+      logging.debug('adding label: %r', label)
       self.labels.append(label)
 
   def formattedSubmitted(self):
@@ -567,18 +794,27 @@ class Quote(search.SearchableModel):
   def rate(self, account, value):
     rating = self.getAccountRating(account)
     def transaction(rating=rating):
-      buckets = self.getRatingBuckets()
+      # self may be a memcache copy; re-read inside the transaction so the
+      # totals and buckets are updated from current datastore state.  The
+      # put drops the by-key cache entry, so the next view re-caches the
+      # fresh entity.
+      quote = db.get(self.key())
+      buckets = quote.getRatingBuckets()
       if rating and rating.value in buckets:
         buckets[rating.value] -= 1
       buckets[value] = buckets.get(value, 0) + 1
-      self.setRatingBuckets(buckets)
+      quote.setRatingBuckets(buckets)
       if rating:
-        self.rating_total += value - rating.value
+        quote.rating_total += value - rating.value
       else:
-        self.rating_count += 1
-        self.rating_total += value
-      self.put()
-    db.run_in_transaction(transaction)
+        quote.rating_count += 1
+        quote.rating_total += value
+      quote.put()
+      return quote
+    quote = db.run_in_transaction(transaction)
+    self.rating_total = quote.rating_total
+    self.rating_count = quote.rating_count
+    self.rating_buckets = quote.rating_buckets
 
     if rating:
       rating.timestamp = datetime.datetime.now()
@@ -591,16 +827,16 @@ class Quote(search.SearchableModel):
     return rating.put()
 
   def getRatingBuckets(self):
-    logging.info('get rating buckets')
+    logging.debug('get rating buckets')
     if self.rating_buckets:
-      logging.info('loading from pickle')
+      logging.debug('loading from pickle')
       return pickle.loads(self.rating_buckets)
     else:
       return {}
 
   def rebuildRatingBuckets(self):
     buckets = {}
-    logging.info('loading from ratings')
+    logging.debug('loading from ratings')
     query = Rating.all().filter('quote =', self.key())
     for rating in query.fetch(offset=0, limit=1000):
       buckets[rating.value] = buckets.get(rating.value, 0) + 1
@@ -616,13 +852,13 @@ class Quote(search.SearchableModel):
 
   def ratingBucketChart(self, size='350x75'):
     try:
-      logging.info('ratingBucketChart')
+      logging.debug('ratingBucketChart')
       keys = range(self.MIN_RATING, self.MAX_RATING + 1)
       buckets = self.getRatingBuckets()
       if not buckets:
         self.rebuildRatingBuckets()
         buckets = self.getRatingBuckets()
-      logging.info('buckets: %r', buckets)
+      logging.debug('buckets: %r', buckets)
     except:
       logging.exception('failed to get buckets')
       raise
@@ -647,3 +883,17 @@ class Rating(db.Model):
   quote = db.ReferenceProperty(Quote, required=True)
   value = db.IntegerProperty(required=True)
   timestamp = db.DateTimeProperty(required=True, auto_now_add=True)
+
+  @classmethod
+  def getForAccountAndQuotes(cls, account, quote_list):
+    """Maps quote keys to this account's ratings for a page of quotes.
+
+    One IN query for the whole page instead of an ancestor query per
+    quote; page sizes stay well under the datastore's 30-value IN limit.
+    """
+    if not quote_list:
+      return {}
+    keys = [quote.key() for quote in quote_list]
+    query = cls.gql('WHERE ANCESTOR IS :1 AND quote IN :2', account, keys)
+    return dict((cls.quote.get_value_for_datastore(rating), rating)
+                for rating in query.fetch(limit=len(keys)))
@@ -2,7 +2,6 @@ import datetime
 import logging
 import os
 import re
-import urllib
 import time
 
 from google.appengine.api import users
@@ -425,7 +424,7 @@ class EditDraftService(QuoteService):
         quote = clone
       else:
         quote = draft
-      self.redirect('/quote?key=%s' % urllib.quote(str(quote.key())))
+      self.redirect('/quote?key=%s' % quote.urlKey())
 
 
 class DeleteQuoteService(QuoteService):
@@ -449,20 +448,26 @@ class ClearDataService(Service):
 
   def deleteChunkOfKind(self, kind, batch_size):
     logging.info('session: %s', self.session.key())
-    query = kind.all().fetch(limit=batch_size)
-    count = 0
-    for i, entity in enumerate(query):
-      key = entity.key()
+    # Only keys are needed for the skip checks and the delete, so spare the
+    # datastore from returning (and us from decoding) whole entities.
+    # db.Query rather than kind.all(): SearchableModel.all() doesn't take
+    # keys_only, and getKinds yields both flavors of model.
+    query = db.Query(kind, keys_only=True).fetch(limit=batch_size)
+    # Collect the keys and delete them in one batched RPC rather than one
+    # round trip per entity.
+    keys = []
+    for key in query:
       if key == self.account.key():
         logging.info('Skipping deletion of active user!')
       elif key == self.session.key():
         logging.info("Skipping deletion of active session!")
       else:
         logging.info('  [%5d] Deleting %s %s',
-                     i, kind.__name__, key.id_or_name() or key)
-        entity.delete()
-        count += 1
-    return count
+                     len(keys), kind.__name__, key.id_or_name() or key)
+        keys.append(key)
+    if keys:
+      db.delete(keys)
+    return len(keys)
 
   @classmethod
   def getKinds(cls):
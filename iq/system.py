@@ -62,18 +62,39 @@ class System(db.Expando):
   owner = db.StringProperty()
   stability_level = db.IntegerProperty(default=0)
 
-
-def getSystem():
-  system = System.get_by_key_name(System.SYSTEM_KEY_NAME)
-  if not system:
-    system = System(key_name=System.SYSTEM_KEY_NAME)
-    system.put()
-  return system
+  def put(self):
+    global _system_cache
+    result = db.Expando.put(self)
+    _system_cache = self
+    return result
+
+
+# The System singleton, cached for the life of the process.  Writes go
+# through System.put, which refreshes the cache.
+_system_cache = None
+
+def getSystem(fresh=False):
+  global _system_cache
+  if fresh or _system_cache is None:
+    system = System.get_by_key_name(System.SYSTEM_KEY_NAME)
+    if system is None:
+      if fresh:
+        # fresh callers may already be inside a transaction (the
+        # counters), where get_or_insert would nest transactions; create
+        # inline instead.
+        system = System(key_name=System.SYSTEM_KEY_NAME)
+        system.put()
+      else:
+        # Create the singleton transactionally so two racing first
+        # requests can't both write a fresh System entity.
+        system = System.get_or_insert(System.SYSTEM_KEY_NAME)
+    _system_cache = system
+  return _system_cache
 
 
 def incrementQuoteCount(amount=1, timestamp=None):
   def transaction():
-    system = getSystem()
+    system = getSystem(fresh=True)
     if timestamp:
       system.latest_quote = timestamp
     system.quote_count += amount
@@ -83,7 +104,7 @@ def incrementQuoteCount(amount=1, timestamp=None):
 
 def incrementAccountCount():
   def transaction():
-    system = getSystem()
+    system = getSystem(fresh=True)
     system.account_count += 1
     system.put()
   db.run_in_transaction(transaction)
@@ -1,4 +1,5 @@
 import datetime
+import re
 
 import py.test
 
@@ -45,9 +46,11 @@ class TestLineFormatterRegistry:
   def setup_method(self, method):
     self.saved_registry = quotes.LineFormatterRegistry.registry
     quotes.LineFormatterRegistry.registry = []
+    quotes.LineFormatterRegistry.combined = None
 
   def teardown_method(self, method):
     quotes.LineFormatterRegistry.registry = self.saved_registry
+    quotes.LineFormatterRegistry.combined = None
 
   def test_parseDialog(self):
     dialog = '\n'.join([
@@ -68,23 +71,30 @@ class TestLineFormatterRegistry:
 
   def test_parse(self):
     class F1(quotes.LineFormatter):
+      PATTERN = re.compile(r'.')
+
       @classmethod
-      def match(cls, line):
-        if line:
-          return cls(range=(0, 1), params={'prefix': line[0]})
+      def build(cls, match):
+        return cls(range=match.span(), params={'prefix': match.group(0)})
 
     class Null(quotes.LineFormatter): pass
 
     class F2(F1):
-      def __init__(self, range, params):
-        F1.__init__(self, range=range, params=params, multiple=True)
+      PATTERN = re.compile(r'.')
+
+      @classmethod
+      def build(cls, match):
+        return cls(range=match.span(),
+                   params={'prefix': match.group(0)},
+                   multiple=True,
+                  )
 
     assert len(quotes.LineFormatterRegistry.registry) == 3
 
     formatting = list(quotes.LineFormatterRegistry.parse('line'))
     assert len(formatting) == len('line')
-    for c, f in zip('line', formatting):
-      assert f.range == (0, 1)
+    for i, (c, f) in enumerate(zip('line', formatting)):
+      assert f.range == (i, i + 1)
       assert f.params == {'prefix': c}
 
 
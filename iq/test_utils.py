@@ -7,6 +7,7 @@ from google.appengine.api import datastore_file_stub
 from google.appengine.api import mail_stub
 from google.appengine.api import urlfetch_stub
 from google.appengine.api import user_service_stub
+from google.appengine.api.memcache import memcache_stub
 
 APP_ID = u'test_app'
 AUTH_DOMAIN = 'gmail.com'
@@ -38,6 +39,14 @@ def setup():
   apiproxy_stub_map.apiproxy.RegisterStub(
     'mail', mail_stub.MailServiceStub())
 
+  # Use a fresh memcache stub.
+  apiproxy_stub_map.apiproxy.RegisterStub(
+    'memcache', memcache_stub.MemcacheServiceStub())
+
+  # Drop the cached System singleton along with the datastore.
+  import system
+  system._system_cache = None
+
 
 class Generic:
   def __init__(self, **kwargs):
@@ -1,7 +1,7 @@
+import datetime
 import logging
 import os
 import re
-import urllib
 import wsgiref.handlers
 
 from google.appengine.ext import webapp
@@ -31,7 +31,9 @@ def ui(path, **kwargs):
       tmpl = service.Template()
       f(self, template=tmpl, pre_hook=pre_hook)
       if self.status == 200:
-        self.response.out.write(template.render(tpath, tmpl.__dict__, debug=True))
+        # webapp's template loader caches compiled templates per process;
+        # debug=True would flush that cache (and recompile) every request.
+        self.response.out.write(template.render(tpath, tmpl.__dict__))
     return wrapper
   return decorator
 
@@ -48,7 +50,11 @@ class QuotePage(service.QuoteService):
   @ui('quote.html')
   def get(self):
     self.template.delete_return_url = ''
-    match = self.PATH_PATTERN.match(self.request.path)
+    # Cheap literal test first; /quote?key=... requests never match the
+    # short-id pattern, so skip the regex for them.
+    match = None
+    if self.request.path.startswith('/q/'):
+      match = self.PATH_PATTERN.match(self.request.path)
     if match:
       account_id = int(match.group('account'))
       quote_id = int(match.group('quote'))
@@ -78,11 +84,16 @@ class BrowsePage(browse.BrowseService):
   def get(self):
     self.browseQuotes(browse.PageSpecifier(mode='recent'))
     if self.template.quotes:
+      # One batched rating lookup for the page, not one query per quote.
+      ratings = {}
+      if self.account.trusted:
+        ratings = quotes.Rating.getForAccountAndQuotes(self.account,
+                                                       self.template.quotes)
       for quote in self.template.quotes:
         quote.owner_page = browse.PageSpecifier(mode='recent',
                                                 account=quote.parent())
         if self.account.trusted:
-          rating = quote.getAccountRating(self.account)
+          rating = ratings.get(quote.key())
           if rating:
             quote.account_rating = str(rating.value)
           else:
@@ -108,14 +119,14 @@ class SubmitPage(service.CreateDraftService):
   def post(self):
     draft = self.createDraft()
     if draft:
-      self.redirect('/edit-draft?key=%s' % urllib.quote(str(draft.key())))
+      self.redirect('/edit-draft?key=%s' % draft.urlKey())
 
 
 class EditPage(service.EditService):
   @ui('quote.html', require_trusted=True)
   def get(self):
     draft = self.edit()
-    self.redirect('/edit-draft?key=%s' % urllib.quote(str(draft.key())))
+    self.redirect('/edit-draft?key=%s' % draft.urlKey())
 
 
 class EditDraftPage(service.EditDraftService):
@@ -185,6 +196,24 @@ class LogoutPage(service.LogoutService):
     self.logout()
 
 
+class IncrementQuoteCountTask(webapp.RequestHandler):
+  # Task queue target for quotes.deferIncrementQuoteCount.
+  def post(self):
+    # App Engine sets this header on queue-originated requests and strips
+    # it from external ones; without the check anyone could POST arbitrary
+    # counter adjustments.
+    if not self.request.headers.get('X-AppEngine-QueueName'):
+      self.error(403)
+      return
+    amount = int(self.request.get('amount', '1'))
+    timestamp = self.request.get('timestamp')
+    if timestamp:
+      timestamp = datetime.datetime.fromtimestamp(float(timestamp))
+    else:
+      timestamp = None
+    system.incrementQuoteCount(amount, timestamp=timestamp)
+
+
 def main():
   pages = [
     ('/', BrowsePage),
@@ -199,6 +228,7 @@ def main():
     ('/search', SearchPage),
     ('/submit', SubmitPage),
     ('/logout', LogoutPage),
+    ('/tasks/increment-quote-count', IncrementQuoteCountTask),
     (r'/q/\d+/\d+', QuotePage),
   ]
   application = webapp.WSGIApplication(pages, debug=True)